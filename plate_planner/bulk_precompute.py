@@ -0,0 +1,156 @@
+"""
+Precompute GPT plate rankings for DineND through the OpenAI Batch API.
+
+This script:
+  1. Loads a consolidated menu JSON file.
+  2. Plans candidate plates for every hall / meal at a set of common macro
+     targets, exactly as the /plan-plate endpoint would for an unfiltered request.
+  3. Submits the ranking prompts as one Batch API job (half the price of
+     live completions, 24h completion window) and waits for it to finish.
+  4. Stores each choice in a SQLite file keyed by the endpoint's ranking key.
+
+Point the endpoint's PRECOMPUTED_RANKS_PATH at the output file and run it
+with USE_GPT_RANKER=1; requests whose candidate plates match a precomputed
+list then skip the live GPT call. With the default local ranker the file is
+never read.
+
+Usage: python -m plate_planner.bulk_precompute <consolidated_menu.json> <ranks.sqlite>
+"""
+
+import io
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from typing import Dict, List
+
+import orjson
+from openai import OpenAI
+
+from plate_planner import endpoint
+
+# Targets the app is most often asked for (calories, protein, carbs, fat)
+TYPICAL_TARGETS: List[Dict[str, int]] = [
+    {"calories": 500, "protein": 30, "carbs": 50, "fat": 15},
+    {"calories": 700, "protein": 40, "carbs": 80, "fat": 25},
+    {"calories": 900, "protein": 60, "carbs": 90, "fat": 30},
+    {"calories": 600, "protein": 0, "carbs": 0, "fat": 0},
+    {"calories": 0, "protein": 40, "carbs": 0, "fat": 0},
+]
+
+# Seconds between batch status checks
+POLL_SECONDS: int = 60
+
+def build_requests(menu: Dict) -> List[Dict]:
+    """
+    Build one Batch API request line per (hall, meal, target) whose plates
+    would be ranked by GPT online. Duplicate candidate lists are sent once.
+    """
+    lines: Dict[str, Dict] = {}
+    for hall, meals in menu.get("dining_halls", {}).items():
+        for meal in meals:
+            candidates = endpoint.filter_menu_items(menu, hall, meal, frozenset(), frozenset())
+            if not candidates or len(candidates) > endpoint.LOCAL_MAX_ITEMS:
+                continue  # served through the Pinecone fallback online
+            for target in TYPICAL_TARGETS:
+                targets = dict(sorted(target.items()))
+                pruned = endpoint.prune_candidates(candidates, targets)
+                top_opts = endpoint.search_plates(pruned, targets, deadline=float("inf"))
+                plates = endpoint.plate_payload(top_opts)[:endpoint.MAX_GPT_PLATES]
+                if not plates:
+                    continue
+                key = endpoint.ranking_key(orjson.dumps(plates), hall, meal)
+                lines[key] = {
+                    "custom_id": key,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": endpoint.GPT_MODEL,
+                        "messages": [
+                            {"role": "system", "content": endpoint.RANKER_SYSTEM_PROMPT},
+                            {"role": "user", "content": endpoint.ranking_prompt(plates, hall, meal)},
+                        ],
+                        "temperature": 0.1,
+                        "max_tokens": endpoint._ranker_max_tokens(plates),
+                        "response_format": {"type": "json_object"},
+                    },
+                }
+    return list(lines.values())
+
+def run_batch(client: OpenAI, lines: List[Dict]) -> str:
+    """
+    Upload the request lines, start a batch job, and block until it ends.
+    Returns the output file id.
+    """
+    payload = "\n".join(json.dumps(line) for line in lines).encode()
+    upload = client.files.create(file=("ranks.jsonl", io.BytesIO(payload)), purpose="batch")
+    batch = client.batches.create(
+        input_file_id=upload.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    print(f"Submitted batch {batch.id} with {len(lines)} requests.")
+
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(POLL_SECONDS)
+        batch = client.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        print(f"  {batch.status}: {counts.completed}/{counts.total} done, {counts.failed} failed")
+
+    if batch.status != "completed" or not batch.output_file_id:
+        sys.exit(f"Batch {batch.id} ended with status '{batch.status}'")
+    return batch.output_file_id
+
+def store_results(client: OpenAI, output_file_id: str, db_path: str) -> int:
+    """
+    Parse the batch output and upsert each chosen plate into `db_path`.
+    Returns the number of rankings stored.
+    """
+    db = sqlite3.connect(db_path)
+    db.execute("CREATE TABLE IF NOT EXISTS ranks (key TEXT PRIMARY KEY, plate TEXT NOT NULL)")
+    stored = 0
+    for raw in client.files.content(output_file_id).text.splitlines():
+        result = json.loads(raw)
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            continue
+        try:
+            content = response["body"]["choices"][0]["message"]["content"]
+            plate = orjson.loads(content)
+        except (KeyError, IndexError, orjson.JSONDecodeError):
+            continue
+        db.execute(
+            "INSERT OR REPLACE INTO ranks (key, plate) VALUES (?, ?)",
+            (result["custom_id"], orjson.dumps(plate).decode()),
+        )
+        stored += 1
+    db.commit()
+    db.close()
+    return stored
+
+def main() -> None:
+    """
+    Entry point:
+      - Parses CLI arguments and loads the menu.
+      - Builds ranking requests for every hall / meal / typical target.
+      - Runs them as one batch and writes the choices to SQLite.
+    """
+    if len(sys.argv) != 3:
+        sys.exit("Usage: python -m plate_planner.bulk_precompute <consolidated_menu.json> <ranks.sqlite>")
+
+    with open(sys.argv[1], "r", encoding="utf-8") as fp:
+        menu = endpoint._parse_menu_macros(json.load(fp))
+
+    lines = build_requests(menu)
+    if not lines:
+        sys.exit("No rankings to precompute.")
+
+    client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+    output_file_id = run_batch(client, lines)
+    stored = store_results(client, output_file_id, sys.argv[2])
+    print(f"Stored {stored} precomputed rankings in {sys.argv[2]}.")
+
+if __name__ == "__main__":
+    main()
@@ -45,6 +45,18 @@ def classify_section(category: str) -> str:
             return title
     return "Other"
 
+def parse_num(x) -> int:
+    """
+    Convert nutrition strings ('78g', '120 kcal', etc.) or numbers to int.
+    Falls back to 0 if it cannot parse.
+    """
+    if isinstance(x, (int, float)):
+        return int(x)
+    if isinstance(x, str):
+        m = re.search(r"\d+", x)
+        return int(m.group()) if m else 0
+    return 0
+
 def load_menu(path: str) -> Dict:
     """
     Read and parse the consolidated_menu.json at the given path.
@@ -77,6 +89,9 @@ def build_vectors(menu: Dict, client: OpenAI) -> List[Dict]:
       - `id` (hall|meal|category|dish name)
       - `values` (the embedding)
       - `metadata` (hall, meal, category, nutrition, allergens, section)
+
+    Macro strings are also stored pre-parsed as integer `*_i` fields so the
+    plate planner can read them without regex parsing per request.
     """
 
     batch: List[Dict] = []
@@ -136,6 +151,10 @@ def build_vectors(menu: Dict, client: OpenAI) -> List[Dict]:
                                 "category": category,
                                 "raw_id": raw_id,  # keep original for debugging/auditing
                                 **nutrition,
+                                "calories_i": parse_num(nutrition.get("calories", 0)),
+                                "protein_i": parse_num(nutrition.get("protein", 0)),
+                                "carbs_i": parse_num(nutrition.get("total_carbohydrate", 0)),
+                                "fat_i": parse_num(nutrition.get("total_fat", 0)),
                                 "allergens": allergens,
                                 "section": section,
                                 "serving_size": dish.get("serving_size", ""),
@@ -2,49 +2,108 @@
 Flask API that powers the Plate-Planner feature in the mobile app.
 Key points
 ==========
-* Cached menu JSON with graceful fallback to stale copy.
+* Cached menu JSON with background stale-while-revalidate refresh and
+  graceful fallback to stale copy; shared across worker processes on disk.
 * Fractional servings (0.5-2.0), 2-4 unique dishes, ±10 % macro tolerance.
-* Exhaustive plate enumeration → GPT taste-ranker.
+* Exhaustive plate enumeration → deterministic cohesion ranker, or the GPT
+  taste-ranker with USE_GPT_RANKER=1 (concurrent requests are micro-batched
+  into one completion).
 * Global JSON error handler (400 / 422 / 503 / 500) - no raw tracebacks.
 * Case-insensitive hall / meal / section matching.
 * Same I/O schema as the legacy endpoint: `{ items, totals }`.
 '''
 
+import hashlib
+import heapq
 import json
 import logging
 import os
+import queue
 import time
 import re
+import sqlite3
+import tempfile
+import threading
 import urllib.error
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import lru_cache
-from itertools import combinations, product
+from itertools import product
 from typing import Any, Dict, List
 
+import httpx
+import numpy as np
+import orjson
 import requests
 from flask import Flask, jsonify, request
+from flask.json.provider import JSONProvider
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from werkzeug.exceptions import BadRequest
-from openai import OpenAI
+from openai import DefaultHttpxClient, OpenAI
 from pinecone import Pinecone
 
 # Configuration
 MENU_URL            = os.getenv("MENU_URL", "https://arda-kurama.github.io/dine-nd/consolidated_menu.json")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "dine-nd-menu")
 GPT_MODEL           = os.getenv("GPT_MODEL", "gpt-4.1-nano")
+EMBED_MODEL         = "text-embedding-3-small"  # must match embed_menu.py
+EMBED_CACHE_DIR     = os.path.join(tempfile.gettempdir(), "dine-nd-embeddings")
+EMBED_CACHE_FILES   = 4096
+USE_GPT_RANKER      = os.getenv("USE_GPT_RANKER") == "1"
 MENU_TTL_SECONDS    = 3600
+MENU_GRACE_SECONDS  = 600
+MENU_SHARED_PATH    = os.getenv("MENU_SHARED_PATH", os.path.join(tempfile.gettempdir(), "dine-nd-menu.json"))
 SERVING_OPTIONS     = [0.5, 1.0, 1.5, 2.0]
 MAX_GPT_PLATES      = 30
 TOLERANCE           = 0.10
+TOP_PLATES          = 10
+COMBO_CHUNK         = 64
+LOCAL_MAX_ITEMS     = 40
+VECTOR_TOP_K        = 20
+RANK_BATCH_SIZE     = 8
+RANK_FLUSH_SECONDS  = 0.05
+RANK_WAIT_SECONDS   = 10
+RANK_MAX_INFLIGHT   = 8
+PINECONE_POOL_SIZE  = 25
+PRECOMPUTED_RANKS   = os.getenv("PRECOMPUTED_RANKS_PATH")
+GPT_RPM             = int(os.getenv("GPT_RPM", 500))
+GPT_TPM             = int(os.getenv("GPT_TPM", 200_000))
+EMBED_RPM           = int(os.getenv("EMBED_RPM", 3000))
+EMBED_TPM           = int(os.getenv("EMBED_TPM", 1_000_000))
 
 # Load section mapping definitions
 BASE_DIR = os.path.dirname(__file__)
 JSON_PATH = os.path.join(BASE_DIR, "..", "mobile-app", "src", "components", "section_defs.json")
 with open(JSON_PATH) as fp:
     raw_defs = json.load(fp)
-SECTION_DEFS = [(d["title"], re.compile(d["pattern"])) for d in raw_defs]
+SECTION_TITLES = tuple(d["title"] for d in raw_defs)
+SECTION_RXS = tuple(re.compile(d["pattern"]) for d in raw_defs)
+# The same patterns in MULTILINE mode, for searching a newline-joined block of
+# category names at once: ^ / $ then anchor per name, and no pattern spans
+# lines because none of them match a newline
+SECTION_BLOB_RXS = tuple(re.compile(d["pattern"], re.MULTILINE) for d in raw_defs)
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson for jsonify and request parsing."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        # Hand orjson's bytes straight to the response instead of decoding to
+        # str in dumps() and having Werkzeug encode it back
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), mimetype="application/json"
+        )
 
 # Logging setup
 logging.basicConfig(level=logging.INFO)
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # Custom exceptions
 class InfeasiblePlateError(Exception):
@@ -53,6 +112,18 @@ class InfeasiblePlateError(Exception):
 class MenuFetchError(Exception):
     """Raised when live menu fetch fails and no cache exists."""
 
+class PlanTimeoutError(Exception):
+    """Raised when plate enumeration times out before scoring any plate."""
+
+class RankerUnavailableError(Exception):
+    """Raised when the GPT ranker fails; `plate` is the unranked best plate."""
+
+    def __init__(self, plate: dict):
+        super().__init__("GPT ranker unavailable")
+        self.plate = plate
+
+MACRO_KEYS = ("calories", "protein", "carbs", "fat")
+
 # Utility functions
 def safe_json(data: Dict[str, Any], key: str, default: Any | None = None):
     if key not in data and default is None:
@@ -71,33 +142,425 @@ def parse_num(x: Any) -> int:
         return int(m.group()) if m else 0
     return 0
 
+def read_macro(meta: Dict[str, Any], key: str, raw_key: str) -> int:
+    """
+    Read a macro pre-parsed at upsert time (`calories_i`, ...), falling back
+    to parsing the raw nutrition string for records indexed before that.
+    """
+    val = meta.get(key)
+    if val is not None:
+        return int(val)
+    return parse_num(meta.get(raw_key, 0))
+
 def score_plate(plate, targets):
     """
     Compute squared error between plate nutrition totals and target macros.
     Returns (error_score, macro_sums)
     """
-    totals = {k: 0 for k in targets}
+    cal = pro = carb = fat = 0
     for itm, serv in plate:
-        for k in totals:
-            totals[k] += itm.get(k, 0) * serv
-    err = sum((totals[k] - targets[k]) ** 2 for k in targets if targets[k])
-    return err, totals
+        cal += itm.get("calories", 0) * serv
+        pro += itm.get("protein", 0) * serv
+        carb += itm.get("carbs", 0) * serv
+        fat += itm.get("fat", 0) * serv
+    t_cal, t_pro, t_carb, t_fat = (
+        targets["calories"], targets["protein"], targets["carbs"], targets["fat"]
+    )
+    err = (
+        ((cal - t_cal) ** 2 if t_cal else 0)
+        + ((pro - t_pro) ** 2 if t_pro else 0)
+        + ((carb - t_carb) ** 2 if t_carb else 0)
+        + ((fat - t_fat) ** 2 if t_fat else 0)
+    )
+    return err, {"calories": cal, "protein": pro, "carbs": carb, "fat": fat}
+
+@lru_cache(maxsize=64)
+def combo_index(n: int, r: int) -> np.ndarray:
+    """
+    Every r-combination of range(n) as a read-only (C, r) int32 array in
+    lexicographic order, reused across requests. Built one column at a time
+    with array ops (each row is extended by every index above its last one),
+    so no per-combination Python tuples are created.
+    """
+    idx = np.arange(n, dtype=np.int32).reshape(-1, 1)
+    for _ in range(r - 1):
+        last = idx[:, -1]
+        counts = n - 1 - last
+        starts = np.cumsum(counts, dtype=np.int32) - counts
+        offsets = np.arange(counts.sum(), dtype=np.int32) - np.repeat(starts, counts)
+        idx = np.column_stack((
+            np.repeat(idx, counts, axis=0),
+            np.repeat(last + 1, counts) + offsets,
+        ))
+    idx.flags.writeable = False
+    return idx
+
+@lru_cache(maxsize=8)
+def serving_grid(r: int) -> np.ndarray:
+    """Every serving mix for an r-dish plate as a read-only (S**r, r) array."""
+    grid = np.array(list(product(SERVING_OPTIONS, repeat=r)), dtype=np.float64)
+    grid.flags.writeable = False
+    return grid
+
+def reach_bounds(
+    s_lo: np.ndarray, s_hi: np.ndarray, lo: np.ndarray, hi: np.ndarray, tgt: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Given the reachable [s_lo, s_hi] range of each macro total (last axis),
+    return (outside, bound): whether the tolerance window is unreachable,
+    and the lowest squared error any total in the range could have.
+    """
+    outside = ~((s_hi >= lo) & (s_lo <= hi)).all(axis=-1)
+    gap = np.maximum(s_lo - tgt, 0) + np.maximum(tgt - s_hi, 0)
+    return outside, (gap ** 2).sum(axis=-1)
+
+def combo_bounds(
+    sums: np.ndarray, lo: np.ndarray, hi: np.ndarray, tgt: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    reach_bounds() for each combo given its 1-serving macro sums. Macros are
+    non-negative, so each total lies between the min- and max-serving sums.
+    """
+    return reach_bounds(sums * min(SERVING_OPTIONS), sums * max(SERVING_OPTIONS), lo, hi, tgt)
+
+@lru_cache(maxsize=256)
+def candidate_macros(macro_rows: tuple) -> np.ndarray:
+    """Candidates' (calories, protein, carbs, fat) as a read-only float array."""
+    macros = np.array(macro_rows, dtype=np.float64).reshape(len(macro_rows), len(MACRO_KEYS))
+    macros.flags.writeable = False
+    return macros
+
+@lru_cache(maxsize=8)
+def combo_sums(macro_rows: tuple, r: int) -> np.ndarray:
+    """
+    1-serving macro sums of every r-combo of the candidates, read-only.
+    They don't depend on the targets, so requests over the same candidate
+    list (same hall / meal / filters) reuse them.
+    """
+    sums = candidate_macros(macro_rows)[combo_index(len(macro_rows), r)].sum(axis=1)
+    sums.flags.writeable = False
+    return sums
+
+def level_bounds(
+    sorted_macros: np.ndarray, r: int, lo: np.ndarray, hi: np.ndarray, tgt: np.ndarray
+) -> tuple[bool, float]:
+    """
+    reach_bounds() for every r-dish plate at once: per macro, no r dishes
+    sum below the r smallest values or above the r largest.
+    """
+    s_lo = sorted_macros[:r].sum(axis=0) * min(SERVING_OPTIONS)
+    s_hi = sorted_macros[-r:].sum(axis=0) * max(SERVING_OPTIONS)
+    outside, bound = reach_bounds(s_lo, s_hi, lo, hi, tgt)
+    return bool(outside), float(bound)
+
+def score_combos(
+    grid: np.ndarray, macros: np.ndarray, rows: np.ndarray,
+    lo: np.ndarray, hi: np.ndarray, tgt: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Score every serving mix of every combo in `rows` in one pass. Returns
+    flat (outside, err) arrays indexed by combo * len(grid) + mix: whether
+    any targeted macro misses the tolerance window, and the squared error.
+    """
+    totals = grid @ macros[rows]  # (combos, mixes, macros)
+    errs = ((totals - tgt) ** 2).sum(axis=2).ravel()
+    outs = ~((totals >= lo) & (totals <= hi)).all(axis=2).ravel()
+    return outs, errs
+
+def prune_candidates(candidates: List[dict], targets: Dict[str, Any]) -> List[dict]:
+    """
+    Drop dishes that can only make a plate worse before any combos are built:
+    dishes that overshoot a targeted macro's tolerance window even at the
+    smallest serving, and dishes with none of the targeted macros (water,
+    plain sauces) that just pad plates with identical totals.
+    """
+    keys = [k for k in targets if targets[k]]
+    if not keys:
+        return candidates
+    s_min = min(SERVING_OPTIONS)
+    kept = [
+        itm for itm in candidates
+        if any(itm.get(k, 0) for k in keys)
+        and all(itm.get(k, 0) * s_min <= (1 + TOLERANCE) * targets[k] for k in keys)
+    ]
+    return kept if len(kept) >= 2 else candidates
+
+def unique_dishes(candidates: List[dict]) -> List[dict]:
+    """
+    Collapse candidates listing the same (name, servingSize) dish, keeping
+    the first row. A dish served at several stations would otherwise appear
+    twice on one plate and repeat every plate it is part of.
+    """
+    seen: set = set()
+    unique = []
+    for itm in candidates:
+        label = (itm["name"], itm["servingSize"])
+        if label not in seen:
+            seen.add(label)
+            unique.append(itm)
+    return unique
+
+def search_plates(candidates: List[dict], targets: Dict[str, Any], deadline: float) -> List[dict]:
+    """
+    Enumerate 2-4 dish plates over every serving mix and return the
+    TOP_PLATES best ones: plates with every targeted macro within ±TOLERANCE
+    first, then by squared error. Combos are scored COMBO_CHUNK at a time as
+    (combos, serving mixes, macros) arrays, and only a bounded max-heap of
+    the current best plates is kept. Chunks are visited in order of their
+    combos' best possible rank, so once the heap is full and no remaining
+    combo can beat the worst kept plate, the rest of that combo size is
+    skipped. Candidates are expected to be distinct dishes (see
+    unique_dishes()), so every kept plate is a distinct option.
+    """
+    keys = [k for k in targets if targets[k]]
+    cols = [MACRO_KEYS.index(k) for k in keys]
+    macro_rows = tuple(tuple(itm.get(k, 0) for k in MACRO_KEYS) for itm in candidates)
+    macros = candidate_macros(macro_rows)[:, cols]
+    tgt = np.array([targets[k] for k in keys], dtype=np.float64)
+    lo, hi = (1 - TOLERANCE) * tgt, (1 + TOLERANCE) * tgt
+
+    heap: List[tuple] = []  # (-outside, -err, counter, combo rows, serving mix)
+    counter = 0
+    sorted_macros = np.sort(macros, axis=0)
+    for r in (2, 3, 4):
+        if len(candidates) < r:
+            break
+        # Skip the whole combo size when even its best case can't place
+        if len(heap) == TOP_PLATES and level_bounds(sorted_macros, r, lo, hi, tgt) >= (-heap[0][0], -heap[0][1]):
+            continue
+        idx = combo_index(len(candidates), r)
+        grid = serving_grid(r)
+        c_out, c_bound = combo_bounds(combo_sums(macro_rows, r)[:, cols], lo, hi, tgt)
+        order = np.lexsort((c_bound, c_out))
+        n_mix = len(grid)
+        for start in range(0, len(order), COMBO_CHUNK):
+            if time.time() > deadline:  # hard time-out
+                break
+            chunk = order[start:start + COMBO_CHUNK]
+            if len(heap) == TOP_PLATES:
+                w_out, w_err = -heap[0][0], -heap[0][1]
+                keep = (c_out[chunk] < w_out) | ((c_out[chunk] == w_out) & (c_bound[chunk] < w_err))
+                chunk = chunk[keep]
+                if not len(chunk):
+                    break
+
+            rows = idx[chunk]
+            outs, errs = score_combos(grid, macros, rows, lo, hi, tgt)
+            if len(heap) == TOP_PLATES:
+                w_out, w_err = -heap[0][0], -heap[0][1]
+                flat = np.flatnonzero((outs < w_out) | ((outs == w_out) & (errs < w_err)))
+            else:
+                flat = np.arange(len(errs))
+            for f in flat[np.lexsort((errs[flat], outs[flat]))]:
+                key = (int(outs[f]), float(errs[f]))
+                if len(heap) == TOP_PLATES and key >= (-heap[0][0], -heap[0][1]):
+                    break
+                c, m = divmod(int(f), n_mix)
+                counter += 1
+                entry = (-key[0], -key[1], counter, rows[c], grid[m])
+                if len(heap) < TOP_PLATES:
+                    heapq.heappush(heap, entry)
+                else:
+                    heapq.heapreplace(heap, entry)
+        if time.time() > deadline:
+            break
+
+    results = []
+    for *_, rows, servs in sorted(heap, key=lambda x: (-x[0], -x[1], x[2])):
+        plate = [(candidates[i], float(s)) for i, s in zip(rows, servs)]
+        err, sums = score_plate(plate, targets)
+        results.append({"plate": plate, "score": err, "sums": sums})
+    return results
+
+def rank_plates_local(options: List[dict], targets: Dict[str, Any]) -> int:
+    """
+    Pick the most cohesive of search_plates()' options without a model call
+    and return its index: plates within tolerance first, then plates drawing
+    on the most distinct sections, then fewer items, then lowest error.
+    """
+    def key(opt):
+        within = all(
+            abs(opt["sums"][k] - t) <= TOLERANCE * t for k, t in targets.items() if t
+        )
+        # One section per distinct dish (its first row), so a dish listed
+        # under two sections doesn't count as a more varied plate
+        dishes: Dict[tuple, str] = {}
+        for itm, _ in opt["plate"]:
+            dishes.setdefault((itm["name"], itm["servingSize"]), itm.get("section", "Other"))
+        return (not within, -len(set(dishes.values())), len(dishes), opt["score"])
+    return min(range(len(options)), key=lambda i: key(options[i]))
 
 # Cached menu fetch
+# Within MENU_TTL_SECONDS the cached copy is served as-is. For a further
+# MENU_GRACE_SECONDS the stale copy is still served while one background
+# thread refreshes it, so no request waits on the network after expiry.
+# Refreshes reuse one keep-alive session and revalidate with the stored ETag /
+# Last-Modified, so an unchanged menu costs a 304 instead of a download and
+# JSON parse. Every fetch is also written to MENU_SHARED_PATH, so the other
+# worker processes on the host pick it up instead of fetching it themselves.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=2, pool_maxsize=4,
+    max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504)),
+))
+
 _MENU_CACHE: dict[str, Any] | None = None
 _MENU_CACHE_TIME: float = 0.0
+_MENU_ETAG: str | None = None
+_MENU_LAST_MODIFIED: str | None = None
+_MENU_REFRESHING = threading.Lock()
+_SECTION_INDEX: dict[tuple[str, str], List[str]] = {}  # (hall, meal) -> section titles
 
-def get_menu() -> dict[str, Any]:
-    global _MENU_CACHE, _MENU_CACHE_TIME
-    if _MENU_CACHE and time.time() - _MENU_CACHE_TIME < MENU_TTL_SECONDS:
+def _slim_dish(dish: dict[str, Any]) -> dict[str, Any]:
+    nutrition = dish.get("nutrition") or {}
+    raw_allergens = dish.get("allergens") or ""
+    if isinstance(raw_allergens, str):
+        raw_allergens = raw_allergens.split(",")
+    return {
+        "name": dish.get("name", "Unnamed Dish"),
+        "serving_size": dish.get("serving_size", ""),
+        "calories_i": parse_num(nutrition.get("calories", 0)),
+        "protein_i": parse_num(nutrition.get("protein", 0)),
+        "carbs_i": parse_num(nutrition.get("total_carbohydrate", 0)),
+        "fat_i": parse_num(nutrition.get("total_fat", 0)),
+        "allergen_set": frozenset(
+            a.strip().lower() for a in raw_allergens if isinstance(a, str)
+        ),
+    }
+
+def _parse_menu_macros(menu: dict[str, Any]) -> dict[str, Any]:
+    """
+    Reduce each dish to what the planner reads, once per fetch: name, serving
+    size, integer `*_i` macros (the same names embed_menu.py writes to
+    Pinecone) and a lowercase `allergen_set`. Ingredients and the rest of
+    the nutrition panel are dropped so the cached menu stays small.
+    """
+    for hall_data in menu.get("dining_halls", {}).values():
+        for meal_data in hall_data.values():
+            for dishes in meal_data.get("categories", {}).values():
+                if isinstance(dishes, list):
+                    dishes[:] = [_slim_dish(d) for d in dishes if isinstance(d, dict)]
+    return menu
+
+def _index_sections(menu: dict[str, Any]) -> None:
+    """
+    Rebuild the (hall, meal) -> section titles map served by /sections.
+    Runs whenever a new menu is cached, so the route is a dict lookup.
+    """
+    global _SECTION_INDEX
+    index = {}
+    for hall, hall_data in menu.get("dining_halls", {}).items():
+        for meal, meal_data in hall_data.items():
+            if "categories" not in meal_data:
+                continue
+            cats = list(meal_data["categories"])
+            if any("\n" in cat for cat in cats):
+                hits: set = set()
+                for cat in cats:
+                    hits.update(matching_sections(cat))
+                index[(hall, meal)] = [title for title in SECTION_TITLES if title in hits]
+                continue
+            blob = "\n".join(cats)
+            index[(hall, meal)] = [
+                title for title, rx in zip(SECTION_TITLES, SECTION_BLOB_RXS) if rx.search(blob)
+            ]
+    _SECTION_INDEX = index
+
+def _load_shared_menu() -> bool:
+    """
+    Adopt the menu another worker wrote to MENU_SHARED_PATH if it is newer
+    than ours and still within MENU_TTL_SECONDS. Returns True if adopted.
+    """
+    global _MENU_CACHE, _MENU_CACHE_TIME, _MENU_ETAG, _MENU_LAST_MODIFIED
+    try:
+        mtime = os.stat(MENU_SHARED_PATH).st_mtime
+        if mtime <= _MENU_CACHE_TIME or time.time() - mtime >= MENU_TTL_SECONDS:
+            return False
+        with open(MENU_SHARED_PATH, "rb") as fp:
+            shared = orjson.loads(fp.read())
+        menu = _parse_menu_macros(shared["menu"])
+    except (OSError, orjson.JSONDecodeError, KeyError, TypeError, AttributeError) as e:
+        # Missing, partial or foreign file: fetch the menu ourselves instead
+        if not isinstance(e, FileNotFoundError):
+            logging.warning("Ignoring unreadable shared menu cache: %r", e)
+        return False
+    _MENU_ETAG = shared.get("etag")
+    _MENU_LAST_MODIFIED = shared.get("last_modified")
+    _MENU_CACHE, _MENU_CACHE_TIME = menu, mtime
+    _index_sections(_MENU_CACHE)
+    return True
+
+def _store_shared_menu(raw: bytes | None) -> None:
+    """
+    Publish the fetched menu body (or, for a 304, just a fresh mtime) to
+    MENU_SHARED_PATH. The file is swapped in atomically so readers never see
+    a partial write.
+    """
+    try:
+        if raw is None:
+            os.utime(MENU_SHARED_PATH)
+            return
+        blob = orjson.dumps({
+            "etag": _MENU_ETAG,
+            "last_modified": _MENU_LAST_MODIFIED,
+            "menu": orjson.Fragment(raw),
+        })
+        tmp = f"{MENU_SHARED_PATH}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as fp:
+            fp.write(blob)
+        os.replace(tmp, MENU_SHARED_PATH)
+    except OSError as e:
+        logging.warning("Could not write shared menu cache: %s", e)
+
+def _fetch_menu() -> dict[str, Any]:
+    global _MENU_CACHE, _MENU_CACHE_TIME, _MENU_ETAG, _MENU_LAST_MODIFIED
+    if _load_shared_menu():
+        return _MENU_CACHE
+    logging.info("Fetching menu JSON …")
+    headers = {}
+    if _MENU_CACHE:
+        if _MENU_ETAG:
+            headers["If-None-Match"] = _MENU_ETAG
+        if _MENU_LAST_MODIFIED:
+            headers["If-Modified-Since"] = _MENU_LAST_MODIFIED
+    r = _SESSION.get(MENU_URL, timeout=(2, 8), headers=headers)
+    if r.status_code == 304:
+        _MENU_CACHE_TIME = time.time()
+        _store_shared_menu(None)
         return _MENU_CACHE
+    r.raise_for_status()
+    menu = _parse_menu_macros(orjson.loads(r.content))
+    _MENU_ETAG = r.headers.get("ETag")
+    _MENU_LAST_MODIFIED = r.headers.get("Last-Modified")
+    _MENU_CACHE, _MENU_CACHE_TIME = menu, time.time()
+    _index_sections(menu)
+    _store_shared_menu(r.content)
+    return _MENU_CACHE
+
+def _refresh_menu() -> None:
     try:
-        logging.info("Fetching menu JSON …")
-        r = requests.get(MENU_URL, timeout=8)
-        r.raise_for_status()
-        _MENU_CACHE, _MENU_CACHE_TIME = r.json(), time.time()
+        _fetch_menu()
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
+        logging.error("Background menu refresh failed: %s", e)
+    finally:
+        _MENU_REFRESHING.release()
+
+def menu_is_warm() -> bool:
+    """True when get_menu() can answer from cache without blocking."""
+    age = time.time() - _MENU_CACHE_TIME
+    return bool(_MENU_CACHE) and age < MENU_TTL_SECONDS + MENU_GRACE_SECONDS
+
+def get_menu() -> dict[str, Any]:
+    age = time.time() - _MENU_CACHE_TIME
+    if _MENU_CACHE and age < MENU_TTL_SECONDS:
+        return _MENU_CACHE
+    if _MENU_CACHE and age < MENU_TTL_SECONDS + MENU_GRACE_SECONDS:
+        if _MENU_REFRESHING.acquire(blocking=False):
+            threading.Thread(target=_refresh_menu, daemon=True).start()
         return _MENU_CACHE
-    except requests.RequestException as e:
+    try:
+        return _fetch_menu()
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
         logging.error("Menu fetch failed: %s", e)
         if _MENU_CACHE:
             logging.warning("Serving stale cached menu")
@@ -105,6 +568,8 @@ def get_menu() -> dict[str, Any]:
         raise MenuFetchError("Dining menu temporarily unavailable. Try again later.") from e
 
 # Memoized external clients
+_IO_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="plan-io")
+
 @lru_cache(maxsize=1)
 def pc_index():
     api_key = os.environ.get("PINECONE_API_KEY")
@@ -112,61 +577,438 @@ def pc_index():
     if not api_key or not env:
         raise RuntimeError("PINECONE_API_KEY / PINECONE_ENV missing from environment")
     pc = Pinecone(api_key=api_key, environment=env)
-    return pc.Index(PINECONE_INDEX_NAME)
+    # Size the urllib3 pool for concurrent requests rather than the SDK's
+    # cpu_count() * 5 default, which churns connections on small containers
+    return pc.Index(
+        PINECONE_INDEX_NAME,
+        pool_threads=PINECONE_POOL_SIZE,
+        connection_pool_maxsize=PINECONE_POOL_SIZE,
+    )
 
 @lru_cache(maxsize=1)
 def _openai_client():
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY is missing from environment")
-    return OpenAI(api_key=api_key)
+    # Keep idle TLS connections for a minute (the SDK default is 5 s), so a
+    # warm worker between requests reuses them instead of re-handshaking
+    return OpenAI(api_key=api_key, http_client=DefaultHttpxClient(
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60.0),
+        timeout=httpx.Timeout(30.0, connect=5.0),
+    ))
+
+class _TokenBucket:
+    """
+    Per-worker request and token budget for one OpenAI model, refilled
+    continuously at the per-minute limits. acquire() books the call up
+    front and sleeps off any deficit, so a burst is smoothed out here
+    instead of failing upstream with a 429 halfway through a plan. The sleep
+    blocks the calling thread, so it belongs on the thread about to make the
+    call (a request thread or a _RankBatcher dispatch thread), never on one
+    that other callers queue behind.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rps = rpm / 60
+        self.tps = tpm / 60
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> None:
+        with self._lock:
+            now = time.monotonic()
+            elapsed, self._last = now - self._last, now
+            self._requests = min(self.rpm, self._requests + elapsed * self.rps) - 1
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tps) - tokens
+            wait = max(0.0, -self._requests / self.rps, -self._tokens / self.tps)
+        if wait:
+            logging.info("OpenAI rate limit: waiting %.2fs", wait)
+            time.sleep(wait)
+
+_EMBED_LIMIT = _TokenBucket(EMBED_RPM, EMBED_TPM)
+_GPT_LIMIT = _TokenBucket(GPT_RPM, GPT_TPM)
+
+def _estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text and JSON
+    return len(text) // 4 + 1
+
+@lru_cache(maxsize=4096)
+def _embed(text: str) -> tuple:
+    """
+    Embed a query string. Embeddings are deterministic for a given input, so
+    results are memoized as immutable tuples, and also stored on disk as
+    float32 bytes under SHA256(model | text) so other workers and warm Lambda
+    containers skip the API call for queries they haven't seen themselves.
+    """
+    key = hashlib.sha256(f"{EMBED_MODEL}|{text}".encode()).hexdigest()
+    path = os.path.join(EMBED_CACHE_DIR, f"{key}.f32")
+    try:
+        with open(path, "rb") as fp:
+            vec = np.frombuffer(fp.read(), dtype=np.float32)
+        if len(vec):
+            os.utime(path)  # mark as recently used for _prune_embed_cache()
+            return tuple(vec.tolist())
+    except (OSError, ValueError):
+        pass
+
+    _EMBED_LIMIT.acquire(_estimate_tokens(text))
+    vec = tuple(_openai_client().embeddings.create(
+        model=EMBED_MODEL,
+        input=text
+    ).data[0].embedding)
+    try:
+        os.makedirs(EMBED_CACHE_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as fp:
+            fp.write(np.asarray(vec, dtype=np.float32).tobytes())
+        os.replace(tmp, path)
+        _prune_embed_cache()
+    except OSError as e:
+        logging.warning("Could not write embedding cache: %s", e)
+    return vec
+
+def _prune_embed_cache() -> None:
+    """
+    Keep at most EMBED_CACHE_FILES embeddings on disk by deleting the least
+    recently used, so the cache can't fill a small /tmp (512 MB on Lambda,
+    shared with MENU_SHARED_PATH).
+    """
+    with os.scandir(EMBED_CACHE_DIR) as it:
+        files = [(f.stat().st_mtime, f.path) for f in it if f.name.endswith(".f32")]
+    if len(files) <= EMBED_CACHE_FILES:
+        return
+    files.sort()
+    for _, path in files[:len(files) - EMBED_CACHE_FILES]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # already pruned by another worker
+
+# GPT ranker prompt
+# The system message is kept byte-identical across requests (no hall / meal /
+# plate interpolation) and padded past OpenAI's 1024-token prompt-cache
+# threshold, so repeat calls bill the prefix at the cached-input rate.
+RANKER_SCHEMA = {
+    "items": [{"name": "...", "servings": "...", "servingSize": "..."}],
+    "totals": {"calories": 0, "protein": 0, "carbs": 0, "fat": 0}
+}
+
+RANKER_SCHEMA_JSON = json.dumps(RANKER_SCHEMA, separators=(",", ":"))
+
+# Fixed tails of the user message, so requests only format the plate data
+RANKER_SINGLE_FOOTER = "\n\nReturn the single best plate as JSON in the required schema."
+RANKER_BATCH_FOOTER = '\n\nReturn {"choices": [...]} with one plate per block, in block order.'
+
+RANKER_SYSTEM_PROMPT = "\n".join([
+    "You are a precise JSON-only nutrition assistant for a college dining hall meal planner.",
+    "A student has entered calorie and macro targets. A solver has already enumerated candidate",
+    "plates from the dishes actually being served, and every candidate is close to the targets.",
+    "Your only job is to choose the ONE candidate plate that a student would most enjoy eating",
+    "together as a single meal, while staying faithful to the nutrition the solver computed.",
+    "",
+    "Hard rules:",
+    "1. Choose exactly one plate from the candidates in the user message. Never merge plates.",
+    "2. Copy item names character-for-character. Do not fix spelling, capitalization, or punctuation.",
+    "3. Do not add, remove, or rename items, and do not change any serving counts.",
+    "4. Copy servingSize strings exactly as given, even when they are empty.",
+    "5. Copy the totals object of the chosen plate exactly as given. Do not recompute it.",
+    "6. Return only the JSON object described below. No prose, no markdown, no code fences.",
+    "",
+    "Serving-size rubric:",
+    "- Servings are multiples of the listed servingSize: 0.5 is half a portion, 2.0 is a double portion.",
+    "- Prefer plates where the main protein or entree carries the larger serving count.",
+    "- Prefer plates where condiments, sauces, dressings, and toppings stay at 0.5 or 1.0 servings.",
+    "- Avoid plates that need 2.0 servings of a beverage, soup, or side to reach the targets",
+    "  when another candidate reaches similar totals with a more natural portion split.",
+    "- Treat a double serving of a single filling entree as normal; treat a double serving of",
+    "  bread, rice, or pasta alongside another starch as less appealing.",
+    "",
+    "Food-group guidelines (use these to break ties between similar candidates):",
+    "- Protein foods: meat, poultry, fish, eggs, tofu, beans, and dairy-based entrees.",
+    "- Grains: bread, rice, pasta, tortillas, cereal, oatmeal, and baked goods.",
+    "- Vegetables: salads, cooked vegetables, vegetable soups, and vegetable-forward sides.",
+    "- Fruit: whole fruit, fruit cups, and fruit-based sides.",
+    "- Dairy: milk, yogurt, cheese, and dairy-based drinks.",
+    "- A well-rounded plate usually covers a protein food plus at least one other group.",
+    "- Plates covering three or more groups are preferred over plates covering one group,",
+    "  provided the items still make sense on the same tray.",
+    "",
+    "Cohesion rubric (most important first):",
+    "1. Items should plausibly be eaten together in one sitting for the given meal period.",
+    "   Breakfast items pair with breakfast items; a dessert alone is not a meal.",
+    "2. Cuisines should be compatible: a burrito bowl pairs with chips or a side salad more",
+    "   naturally than with a bowl of ramen.",
+    "3. Avoid redundant plates, such as three different breads or two nearly identical entrees.",
+    "4. Avoid plates made entirely of drinks, condiments, or dessert items.",
+    "5. Prefer plates with a clear main item supported by one or two complementary sides.",
+    "6. When two plates are equally cohesive, prefer the one with fewer distinct items.",
+    "7. When still tied, prefer the candidate that appears earlier in the list, because",
+    "   candidates are listed in order of how closely they match the macro targets.",
+    "",
+    "Meal-period guidelines:",
+    "- Breakfast: eggs, breakfast meats, pancakes, waffles, oatmeal, yogurt, cereal, fruit,",
+    "  toast, and pastries are natural. Heavy dinner entrees are unusual at breakfast.",
+    "- Brunch: any breakfast item plus lighter lunch items such as salads, soups, and sandwiches.",
+    "- Lunch: sandwiches, wraps, bowls, salads, soups, pizza, pasta, and grill items are natural.",
+    "- Dinner: plated entrees, pasta, stir-fry, curry, grill items, and hearty sides are natural.",
+    "- Late night: pizza, grill items, snacks, and desserts are all reasonable.",
+    "- Drinks such as milk, juice, or coffee are fine as one supporting item but never the focus.",
+    "",
+    "Dietary notes:",
+    "- Allergen and section filters have already been applied; every candidate is allowed.",
+    "- Do not second-guess those filters and do not swap in items that are not listed.",
+    "- Do not prefer or penalize a plate because of any single macro once it meets the targets;",
+    "  the solver already balanced the numbers, so cohesion is what separates candidates.",
+    "",
+    "Input format:",
+    "- The user message names the dining hall and meal period, then lists candidate plates",
+    "  as a JSON array. Each candidate has an items array and a totals object.",
+    "- Each item has a name, a servings multiplier, and a servingSize description.",
+    "- Totals are the calories, protein, carbs, and fat of the whole plate at those servings.",
+    "",
+    "Output format:",
+    "- Return a single JSON object with exactly two keys: items and totals.",
+    "- items is the chosen candidate's items array, copied verbatim.",
+    "- totals is the chosen candidate's totals object, copied verbatim.",
+    "- Use this exact schema:",
+    RANKER_SCHEMA_JSON,
+    "- When the user message contains several numbered blocks, rank each block independently",
+    "  and return {\"choices\": [...]} holding one plate object per block, in block order.",
+    "",
+    "If every candidate looks unappealing, still return the most reasonable one; never refuse,",
+    "never return an empty object, and never explain your choice.",
+])
 
 # GPT-Based plate selector
-def gpt_choose_plate(plates: List[dict]) -> dict:
+def _ranker_max_tokens(plates: List[dict]) -> int:
+    # One plate object in the reply: ~40 tokens of keys/totals + ~25 per item
+    return 40 + 25 * max((len(p.get("items", [])) for p in plates), default=4)
+
+def _log_ranker_usage(usage: Any, max_tokens: int) -> None:
+    details = getattr(usage, "prompt_tokens_details", None)
+    logging.info(
+        "GPT ranker tokens: prompt %s (cached: %s), completion %s / %s",
+        usage.prompt_tokens,
+        getattr(details, "cached_tokens", 0) if details else 0,
+        usage.completion_tokens,
+        max_tokens,
+    )
+
+def _ranker_completion(user_content: str, max_tokens: int) -> dict:
+    """
+    Send one ranking prompt behind the cached system prompt and return the
+    parsed JSON reply. Output is capped at `max_tokens` in JSON mode and
+    streamed. Once the top-level object's braces balance, the stream is only
+    read on for the finish and usage chunks; it is closed at the first
+    content after the object, so trailing whitespace the model pads JSON
+    mode with is never waited on.
+    """
+    _GPT_LIMIT.acquire(_estimate_tokens(RANKER_SYSTEM_PROMPT + user_content) + max_tokens)
+    stream = _openai_client().chat.completions.create(
+        model=GPT_MODEL,
+        messages=[
+            {"role": "system", "content": RANKER_SYSTEM_PROMPT},
+            {"role": "user", "content": user_content},
+        ],
+        temperature=0.1,
+        max_tokens=max_tokens,
+        response_format={"type": "json_object"},
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    buf: List[str] = []
+    depth, in_str, escaped = 0, False, False
+    closed = False
+    try:
+        for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                _log_ranker_usage(chunk.usage, max_tokens)
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if getattr(choice, "finish_reason", None) == "length":
+                logging.warning("GPT ranker reply hit max_tokens=%s", max_tokens)
+            text = choice.delta.content or ""
+            if closed:
+                if text:
+                    break  # padding after the object; its usage chunk isn't worth the wait
+                continue
+            for i, ch in enumerate(text):
+                if in_str:
+                    if escaped:
+                        escaped = False
+                    elif ch == "\\":
+                        escaped = True
+                    elif ch == '"':
+                        in_str = False
+                elif ch == '"':
+                    in_str = True
+                elif ch == "{":
+                    depth += 1
+                elif ch == "}":
+                    depth -= 1
+                    if depth == 0:
+                        buf.append(text[:i + 1])
+                        closed = True
+                        break
+            else:
+                buf.append(text)
+    finally:
+        stream.close()
+    return orjson.loads("".join(buf))
+
+def _ranking_block(plates: List[dict], hall: str, meal: str) -> str:
+    # Only the variable data goes into the user message, after the cached prefix
+    return (
+        f"Dining hall: {hall}\nMeal period: {meal}\n\nCandidate plates:\n"
+        + orjson.dumps(plates).decode()
+    )
+
+def ranking_prompt(plates: List[dict], hall: str, meal: str) -> str:
+    """User message for ranking one candidate list (shared with bulk_precompute.py)."""
+    return _ranking_block(plates, hall, meal) + RANKER_SINGLE_FOOTER
+
+def _rank_single(plates: List[dict], hall: str, meal: str) -> dict:
+    return _ranker_completion(ranking_prompt(plates, hall, meal), _ranker_max_tokens(plates))
+
+class _RankBatcher:
+    """
+    Coalesce ranking requests that arrive within RANK_FLUSH_SECONDS (or until
+    RANK_BATCH_SIZE are queued) into one chat completion with numbered blocks.
+    A lone request goes through the normal single-plate prompt. Batches are
+    sent from a pool of up to `max_inflight` threads, so the collector keeps
+    draining the queue while earlier completions are still running.
+    """
+
+    def __init__(self, max_batch: int, flush_seconds: float, max_inflight: int):
+        self.max_batch = max_batch
+        self.flush_seconds = flush_seconds
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="rank")
+
+    def submit(self, plates: List[dict], hall: str, meal: str) -> Future:
+        fut: Future = Future()
+        self._queue.put((fut, plates, hall, meal))
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return fut
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._pool.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch: List[tuple]) -> None:
+        # Runs on a pool thread, so a rate-limit wait inside _ranker_completion()
+        # holds up this batch only, while the collector keeps forming the next.
+        # Drop requests whose caller gave up while the batch waited for a slot
+        batch = [b for b in batch if b[0].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            if len(batch) == 1:
+                _, plates, hall, meal = batch[0]
+                results = [_rank_single(plates, hall, meal)]
+            else:
+                prompt_parts = [f"Rank the best plate for each of the {len(batch)} blocks below."]
+                for n, (_, plates, hall, meal) in enumerate(batch, 1):
+                    prompt_parts.append(f"\n\nBlock {n}:\n" + _ranking_block(plates, hall, meal))
+                prompt_parts.append(RANKER_BATCH_FOOTER)
+                max_tokens = 20 + sum(_ranker_max_tokens(plates) for _, plates, *_ in batch)
+                results = _ranker_completion("".join(prompt_parts), max_tokens)["choices"]
+                if len(results) != len(batch):
+                    raise ValueError(f"expected {len(batch)} choices, got {len(results)}")
+        except Exception as e:
+            for fut, *_ in batch:
+                fut.set_exception(e)
+            return
+        for (fut, *_), result in zip(batch, results):
+            fut.set_result(result)
+
+_RANK_BATCHER = _RankBatcher(RANK_BATCH_SIZE, RANK_FLUSH_SECONDS, RANK_MAX_INFLIGHT)
+
+def ranking_key(plates_key: bytes, hall: str, meal: str) -> str:
+    """Stable id for one ranking: hall, meal and the serialized plates."""
+    return hashlib.sha256(orjson.dumps([hall, meal]) + plates_key).hexdigest()
+
+@lru_cache(maxsize=1)
+def _precomputed_db() -> sqlite3.Connection | None:
+    if not PRECOMPUTED_RANKS or not os.path.exists(PRECOMPUTED_RANKS):
+        return None
+    return sqlite3.connect(f"file:{PRECOMPUTED_RANKS}?mode=ro", uri=True, check_same_thread=False)
+
+def _precomputed_rank(plates_key: bytes, hall: str, meal: str) -> dict | None:
+    """
+    Look up a choice made offline by bulk_precompute.py through the Batch
+    API. Only requests whose candidate list matches a precomputed one
+    byte-for-byte (e.g. unfiltered requests with common targets) hit.
+    """
+    db = _precomputed_db()
+    if db is None:
+        return None
+    row = db.execute(
+        "SELECT plate FROM ranks WHERE key = ?", (ranking_key(plates_key, hall, meal),)
+    ).fetchone()
+    return orjson.loads(row[0]) if row else None
+
+@lru_cache(maxsize=1024)
+def _rank_cached(plates_key: bytes, hall: str, meal: str) -> dict:
+    """
+    Rank one serialized candidate list. Memoized on the exact plates / hall /
+    meal, so different requests that reduce to the same candidates (e.g. an
+    allergen filter that removes nothing) share one GPT call. Failures raise
+    and are therefore never cached.
+    """
+    precomputed = _precomputed_rank(plates_key, hall, meal)
+    if precomputed is not None:
+        return precomputed
+    plates = orjson.loads(plates_key)
+    fut = _RANK_BATCHER.submit(plates, hall, meal)
+    try:
+        try:
+            return fut.result(timeout=RANK_WAIT_SECONDS)
+        except TimeoutError:
+            if not fut.cancel():
+                # Already sent in a batch: its answer is on the way, and a
+                # single request now would pay for a second completion
+                return fut.result()
+            logging.warning("GPT ranking still queued after %ss – sending as single request", RANK_WAIT_SECONDS)
+    except Exception as e:
+        logging.warning("Batched GPT ranking failed (%s) – retrying as single request", e)
+    return _rank_single(plates, hall, meal)
+
+def gpt_choose_plate(plates: List[dict], hall: str, meal: str) -> dict:
     """
     Ask GPT to choose the most cohesive and tasty plate from a list.
-    Returns selected plate JSON.
+    Returns selected plate JSON, or raises RankerUnavailableError carrying
+    the first plate so callers can serve it without memoizing it.
     """
     if not plates:
         raise InfeasiblePlateError("No feasible plates to rank")
     plates = plates[:MAX_GPT_PLATES]
 
-    # Define output schema 
-    schema = {
-        "items": [{"name": "...", "servings": "...", "servingSize": "..."}],
-        "totals": {"calories": 0, "protein": 0, "carbs": 0, "fat": 0}
-    }
-
-    # Build prompt 
-    prompt_parts = [
-        "You are a meal-planning assistant for a college dining hall.",
-        "Choose the most cohesive and tasty plate from these EXACT options provided below.",
-        "CRITICAL: You must ONLY use the exact item names provided in the options. Do NOT add explanatory text, suggestions, or modify item names in any way.",
-        "Select ONE complete plate from the options that best balances taste and nutrition.",
-        "",
-        "Available plates:",
-        json.dumps(plates, indent=2),
-        "",
-        "Return ONLY valid JSON in this exact schema with NO additional text or explanations:",
-        json.dumps(schema, indent=2),
-        "",
-        "Use only the exact item names from the plates above. Do not modify or add to them."
-    ]
-    
-    client = _openai_client()
     try:
-        resp = client.chat.completions.create(
-            model=GPT_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a precise JSON-only nutrition assistant. Return only valid JSON with exact item names from provided options."},
-                {"role": "user", "content": "\n".join(prompt_parts)},
-            ],
-            temperature=0.1,
-        )
-        return json.loads(resp.choices[0].message.content.strip())
+        return _rank_cached(orjson.dumps(plates), hall, meal)
     except Exception as e:
         logging.warning("GPT JSON parse failed (%s) – defaulting to first plate", e)
-        return plates[0]
+        raise RankerUnavailableError(plates[0]) from e
 
 # Global error handler
 @app.errorhandler(Exception)
@@ -180,6 +1022,8 @@ def handle_any(err):
         return jsonify(error="Upstream service error, please retry."), 503
     if isinstance(err, InfeasiblePlateError):
         return jsonify(error=str(err)), 422
+    if isinstance(err, PlanTimeoutError):
+        return jsonify(error=str(err)), 504
     return jsonify(error="Internal server error"), 500
 
 # Healthcheck endpoint
@@ -193,59 +1037,96 @@ def sections():
     hall = request.args.get("hall", "")
     meal = request.args.get("meal", "")
     try:
-        menu = get_menu()
-        # Use the same logic as old_endpoint.py for compatibility
-        try:
-            cats = menu["dining_halls"][hall][meal]["categories"].keys()
-        except KeyError:
-            return jsonify(error="unknown hall or meal"), 400
-        
-        # Return all sections that match at least one category name
-        titles = [
-            title
-            for title, rx in SECTION_DEFS
-            if any(rx.search(cat) for cat in cats)
-        ]
-        
-        return jsonify(sections=titles)
+        get_menu()
     except MenuFetchError:
         return jsonify(sections=[]), 200
 
-# Plate planner endpoint
-@app.route("/plan-plate", methods=["POST"])
-def plan_plate():
+    # Titles are precomputed per hall / meal whenever the menu is refreshed
+    titles = _SECTION_INDEX.get((hall, meal))
+    if titles is None:
+        return jsonify(error="unknown hall or meal"), 400
+
+    # Section lists only change with the menu, so let the app / CDN reuse
+    # them for a few minutes instead of asking again on every screen visit
+    resp = jsonify(sections=titles)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = 300
+    return resp
+
+# Candidate sources
+@lru_cache(maxsize=2048)
+def matching_sections(category: str) -> tuple[str, ...]:
     """
-    Main plate generation endpoint. Uses Pinecone + GPT to return optimal plate.
+    Return every section title whose pattern matches the category string,
+    in SECTION_TITLES order. Category names repeat across meals and days, so
+    each one is run through the patterns once per process.
     """
-    start_time = time.time()
-    data = request.get_json(force=True)
+    return tuple(title for title, rx in zip(SECTION_TITLES, SECTION_RXS) if rx.search(category))
 
-    # Extract fields from user input
-    hall = safe_json(data, "hall")
-    meal = safe_json(data, "meal")
-    targets = {
-        "calories": safe_json(data, "calorieTarget", 0),
-        "protein":  safe_json(data, "proteinTarget", 0),
-        "carbs":    safe_json(data, "carbTarget", 0),
-        "fat":      safe_json(data, "fatTarget", 0),
-    }
-    sections = [s.strip() for s in data.get("sections", [])]
-    avoid    = [a.lower() for a in data.get("avoidAllergies", [])]
+def classify_section(category: str) -> str:
+    """
+    Return the section title that matches the given category string.
+    Falls back to "Other" if no pattern matches (same rule as embed_menu.py).
+    """
+    titles = matching_sections(category)
+    return titles[0] if titles else "Other"
+
+def filter_menu_items(
+    menu: dict[str, Any], hall: str, meal: str, sections: frozenset, avoid: frozenset
+) -> List[dict]:
+    """
+    Build plate candidates for one hall / meal straight from the cached menu,
+    applying the same section and allergen rules as the Pinecone filter.
+    """
+    try:
+        meal_data = menu["dining_halls"][hall][meal]
+    except KeyError:
+        return []
+    if not meal_data.get("available", False):
+        return []
+
+    candidates = []
+    for category, dishes in meal_data.get("categories", {}).items():
+        if not isinstance(dishes, list):
+            continue
+        section = classify_section(category)
+        if sections and section not in sections:
+            continue
+        for dish in dishes:
+            if not isinstance(dish, dict):
+                continue
+            if avoid and not avoid.isdisjoint(dish.get("allergen_set", ())):
+                continue
+            candidates.append({
+                "name": dish.get("name", "Unnamed Dish").strip(),
+                "servingSize": dish.get("serving_size", ""),
+                "section": section,
+                "calories": dish.get("calories_i", 0),
+                "protein":  dish.get("protein_i", 0),
+                "carbs":    dish.get("carbs_i", 0),
+                "fat":      dish.get("fat_i", 0),
+            })
+    return unique_dishes(candidates)
 
-    # Build embedding input 
+def embedding_query(hall: str, meal: str, targets: Dict[str, Any]) -> str:
+    """
+    Build the text embedded for vector search. Targets are rounded to 10 so
+    near-identical requests share one cached embedding.
+    """
     parts = [f"{meal} at {hall}"]
     for k, lbl in [("protein", "g protein"), ("carbs", "g carbs"),
                    ("fat", "g fat"), ("calories", "kcal")]:
         if targets[k]:
-            parts.append(f"{targets[k]}{lbl}")
-    query_text = ", ".join(parts)
-
-    # Pinecone vector search 
-    vec = _openai_client().embeddings.create(
-        model="text-embedding-3-small",
-        input=query_text
-    ).data[0].embedding
+            parts.append(f"{int(round(targets[k], -1))}{lbl}")
+    return ", ".join(parts)
 
+def vector_candidates(
+    vec: List[float], hall: str, meal: str, sections: List[str], avoid: List[str]
+) -> List[dict]:
+    """
+    Retrieve plate candidates by querying Pinecone with the request embedding
+    and the hall / meal / section / allergen filter.
+    """
     filt: dict[str, Any] = {"hall": hall, "meal": meal}
     if sections:
         filt["section"] = {"$in": sections}
@@ -253,54 +1134,147 @@ def plan_plate():
         filt["allergens"] = {"$nin": avoid}
 
     matches = pc_index().query(
-        vector=vec, top_k=25, filter=filt, include_metadata=True
-    ).get("matches", [])[:20]
+        vector=vec, top_k=VECTOR_TOP_K, filter=filt, include_values=False, include_metadata=True
+    ).get("matches", [])
 
     # Format candidate dishes
     candidates = []
     for m in matches:
-        meta = getattr(m, "metadata", m.get("metadata", {}))
-        dish = meta.get("name", "Unnamed Dish").strip()
+        meta = m.get("metadata") or {}
         candidates.append({
-            "name": dish,
+            "name": meta.get("name", "Unnamed Dish").strip(),
             "servingSize": meta.get("serving_size", ""),
-            "calories": parse_num(meta.get("calories", 0)),
-            "protein":  parse_num(meta.get("protein", 0)),
-            "carbs":    parse_num(meta.get("total_carbohydrate", 0)),
-            "fat":      parse_num(meta.get("total_fat", 0)),
+            "section": meta.get("section", "Other"),
+            "calories": read_macro(meta, "calories_i", "calories"),
+            "protein":  read_macro(meta, "protein_i", "protein"),
+            "carbs":    read_macro(meta, "carbs_i", "total_carbohydrate"),
+            "fat":      read_macro(meta, "fat_i", "total_fat"),
         })
+    return unique_dishes(candidates)
 
-    # Brute-force through all plate combos
-    scored: List[dict] = []
-    for r in (2, 3, 4):
-        for combo in combinations(candidates, r):
-            for servs in product(SERVING_OPTIONS, repeat=r):
-                if time.time() - start_time > 8:  # hard time-out
-                    break
-                plate = list(zip(combo, servs))
-                err, sums = score_plate(plate, targets)
-                scored.append({"plate": plate, "score": err, "sums": sums})  # Use "score" key like old_endpoint.py
-            if time.time() - start_time > 8:
-                break
-        if time.time() - start_time > 8:
-            break
-    if not scored:
-        return jsonify(error="Could not compute plate in time"), 504  # Return 504 like old_endpoint.py
-
-    scored.sort(key=lambda x: x["score"])  # Sort by "score" key
-    top_opts = scored[:10]
-
-    # Ask GPT to select most appealing plate
-    opts_payload = [
+# Plate planner
+def plate_payload(options: List[dict]) -> List[dict]:
+    """Reduce search_plates() options to the `{ items, totals }` response shape."""
+    return [
         {"items": [{"name": itm["name"], "servings": s, "servingSize": itm["servingSize"]}
                    for itm, s in opt["plate"]],
          "totals": opt["sums"]}
-        for opt in top_opts
+        for opt in options
     ]
-    choice = gpt_choose_plate(opts_payload)
 
-    return jsonify(choice), 200
+@lru_cache(maxsize=512)
+def _plan(
+    hall: str,
+    meal: str,
+    sections_t: frozenset,
+    avoid_t: frozenset,
+    targets_t: tuple,
+    menu_version: float | None,
+) -> dict:
+    """
+    Plan one plate for a normalized request. Memoized so identical requests
+    skip the embedding, Pinecone and GPT calls; `menu_version` is the load
+    time of the menu the request is planned against, so entries are dropped
+    as soon as the menu is replaced.
+    """
+    start_time = time.time()
+    targets = dict(targets_t)
+    sections = sorted(sections_t)
+    avoid = sorted(avoid_t)
+
+    # When the menu needs a blocking fetch, start the Pinecone host lookup
+    # behind pc_index() alongside it, and the (billed) embedding too if the
+    # menu copy we still hold says this hall / meal falls back to Pinecone,
+    # so the fallback doesn't pay the waits back to back. A worker holding
+    # no menu yet skips the embedding: most hall / meal menus are scored
+    # locally, so it would usually be thrown away
+    query_text = embedding_query(hall, meal, targets)
+    vec_future = None
+    if not menu_is_warm():
+        if _MENU_CACHE:
+            held = filter_menu_items(_MENU_CACHE, hall, meal, sections_t, avoid_t)
+            if not held or len(held) > LOCAL_MAX_ITEMS:
+                vec_future = _IO_POOL.submit(_embed, query_text)
+        if not pc_index.cache_info().currsize:
+            _IO_POOL.submit(pc_index)
+
+    # Small hall/meal menus are scored straight from the cached menu, which
+    # skips the embedding and Pinecone round-trips entirely
+    try:
+        candidates = filter_menu_items(get_menu(), hall, meal, sections_t, avoid_t)
+    except MenuFetchError:
+        candidates = []
+    if not candidates or len(candidates) > LOCAL_MAX_ITEMS:
+        vec = vec_future.result() if vec_future else _embed(query_text)
+        candidates = vector_candidates(list(vec), hall, meal, sections, avoid)
+
+    candidates = prune_candidates(candidates, targets)
+    top_opts = search_plates(candidates, targets, deadline=start_time + 8)
+    if not top_opts:
+        raise PlanTimeoutError("Could not compute plate in time")
+
+    opts_payload = plate_payload(top_opts)
+    if not USE_GPT_RANKER:
+        return opts_payload[rank_plates_local(top_opts, targets)]
+
+    # Ask GPT to select most appealing plate
+    return gpt_choose_plate(opts_payload, hall, meal)
+
+# Plate planner endpoint
+def _plan_args(raw: bytes) -> tuple:
+    """Normalized _plan() arguments (minus the menu version) for one request body."""
+    try:
+        data = orjson.loads(raw)
+    except orjson.JSONDecodeError as e:
+        raise BadRequest("Request body must be valid JSON") from e
+
+    # Extract fields from user input
+    hall = safe_json(data, "hall")
+    meal = safe_json(data, "meal")
+    targets = {
+        "calories": safe_json(data, "calorieTarget", 0),
+        "protein":  safe_json(data, "proteinTarget", 0),
+        "carbs":    safe_json(data, "carbTarget", 0),
+        "fat":      safe_json(data, "fatTarget", 0),
+    }
+    sections = frozenset(s.strip() for s in data.get("sections", []))
+    avoid    = frozenset(a.lower() for a in data.get("avoidAllergies", []))
+    return hall, meal, sections, avoid, tuple(sorted(targets.items()))
+
+@app.route("/plan-plate", methods=["POST"])
+def plan_plate():
+    """
+    Main plate generation endpoint. Scores plates from the cached menu (or
+    Pinecone for large menus) and returns the best-ranked one.
+    """
+    # The raw body is only parsed here, so Werkzeug needn't keep a copy
+    args = _plan_args(request.get_data(cache=False))
+    try:
+        if menu_is_warm():
+            # Hands back the cached menu without blocking (refreshing it in the
+            # background once stale), so its load time names the menu planned against
+            get_menu()
+            choice = _plan(*args, _MENU_CACHE_TIME)
+        else:
+            # The menu version is only known once _plan()'s blocking fetch
+            # finishes, so a cold worker plans without memoizing
+            choice = _plan.__wrapped__(*args, None)
+        body = orjson.dumps(choice, option=orjson.OPT_NON_STR_KEYS)
+    except RankerUnavailableError as e:
+        # Serve the solver's best plate, but keep it out of the memos and any
+        # HTTP cache so the next identical request asks GPT again
+        body = orjson.dumps(e.plate, option=orjson.OPT_NON_STR_KEYS)
+        resp = app.response_class(body, mimetype="application/json")
+        resp.cache_control.no_store = True
+        return resp, 200
+
+    resp = app.response_class(body, mimetype="application/json")
+    resp.add_etag()
+    resp.cache_control.public = True
+    resp.cache_control.max_age = 600
+    return resp, 200
 
-# Local development server
+# Local development server (set FLASK_DEBUG=1 for the reloader / debugger).
+# Production traffic goes through Zappa on Lambda or plate_planner.wsgi.
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)), debug=True)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)))
\ No newline at end of file
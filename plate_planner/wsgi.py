@@ -0,0 +1,31 @@
+"""
+WSGI entry point for serving the Plate-Planner API outside of Lambda.
+
+gevent is patched in before anything else is imported, so the outbound
+OpenAI / Pinecone / menu calls yield to other requests instead of blocking
+the worker. Workers share one menu download through MENU_SHARED_PATH
+(see endpoint.py). Install requirements-server.txt (requirements.txt plus
+gunicorn, gevent and Flask-Compress, which the Lambda bundle doesn't need),
+then run from the repository root with:
+
+    gunicorn -k gevent -w $((2 * $(nproc) + 1)) --worker-connections 100 -t 30 plate_planner.wsgi:app
+
+Responses are br / gzip compressed here only: the Zappa deploy runs with
+binary_support off and returns bodies as text, which compressed bytes are not.
+"""
+
+from gevent import monkey
+
+monkey.patch_all()
+
+from flask_compress import Compress  # noqa: E402
+
+from plate_planner.endpoint import app  # noqa: E402
+
+app.config["COMPRESS_ALGORITHM"] = ["br", "gzip"]
+app.config["COMPRESS_MIN_SIZE"] = 500
+app.config["COMPRESS_LEVEL"] = 6
+app.config["COMPRESS_BR_LEVEL"] = 5
+Compress(app)
+
+__all__ = ["app"]